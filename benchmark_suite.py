@@ -0,0 +1,454 @@
+"""
+Benchmark and regression suite for the dd based data paths of disk_tool.py
+(backup, restore, bootable USB and wipe).
+
+Each data path is run against synthetic images (all-zero, random, mixed and a
+fragmented ext4 filesystem) on loop devices, or on plain files when loop
+devices are not available; wipe doesn't read an image and runs once per
+target. Throughput and the CPU time and peak RSS of dd are recorded and
+compared with a baseline; the suite exits with status 1 when a tracked metric
+regresses past the threshold.
+
+Usage:
+  sudo python3 benchmark_suite.py --update-baseline   # Record a baseline
+  sudo python3 benchmark_suite.py                     # Compare against it
+"""
+import argparse
+import json
+import os
+import resource
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import disk_tool
+
+DATA_PATHS = ['backup', 'restore', 'usb', 'wipe']
+IMAGE_KINDS = ['zero', 'random', 'mixed', 'fragmented']
+# Metric -> whether higher or lower values are better
+TRACKED_METRICS = {'throughput_mbps': 'higher', 'cpu_seconds': 'lower', 'peak_rss_kb': 'lower'}
+# Smallest change per metric that counts as a regression, so noise on fast or
+# tiny runs (e.g. 0.010 -> 0.013 CPU seconds) doesn't fail the gate. Throughput
+# is checked as the extra seconds a run takes, which scales with --size-mb.
+MIN_ABSOLUTE_CHANGE = {'throughput_mbps': 0.25, 'cpu_seconds': 0.05, 'peak_rss_kb': 2048}
+# Comparisons against a baseline need at least this much work to be meaningful
+MIN_COMPARE_SIZE_MB = 64
+MIN_COMPARE_REPEAT = 3
+DEFAULT_BASELINE = 'benchmark_baseline.json'
+WIPE_RESULT_NAME = 'wipe/target'
+CHUNK_SIZE = 4 * 1024 * 1024
+
+# --- Synthetic Images ---
+
+def create_zero_image(path, size):
+    """Creates a sparse, all-zero image."""
+    with open(path, 'wb') as image:
+        image.truncate(size)
+
+def create_random_image(path, size):
+    """Creates an image filled with random (incompressible) data."""
+    with open(path, 'wb') as image:
+        for offset in range(0, size, CHUNK_SIZE):
+            image.write(os.urandom(min(CHUNK_SIZE, size - offset)))
+
+def create_mixed_image(path, size):
+    """Creates an image alternating random data, written zeros and holes."""
+    with open(path, 'wb') as image:
+        for index, offset in enumerate(range(0, size, CHUNK_SIZE)):
+            length = min(CHUNK_SIZE, size - offset)
+            if index % 3 == 0:
+                image.write(os.urandom(length))
+            elif index % 3 == 1:
+                image.write(bytes(length))
+            else:
+                image.seek(length, os.SEEK_CUR) # Leave a hole
+        image.truncate(size)
+
+def create_fragmented_image(path, size, work_dir):
+    """
+    Creates an ext4 image filled by interleaved appends to many files, with every
+    other file deleted afterwards. Returns False if it cannot be built here.
+    """
+    create_zero_image(path, size)
+    if subprocess.run(['mkfs.ext4', '-q', '-F', path], capture_output=True).returncode != 0:
+        return False
+    mount_point = os.path.join(work_dir, 'fragmented_mnt')
+    os.makedirs(mount_point, exist_ok=True)
+    if subprocess.run(['mount', '-o', 'loop', path, mount_point], capture_output=True).returncode != 0:
+        return False
+    try:
+        file_count = 64
+        chunk = 64 * 1024
+        rounds = int(size * 0.6) // (file_count * chunk)
+        files = [open(os.path.join(mount_point, f"file_{n}"), 'wb') for n in range(file_count)]
+        try:
+            for _ in range(rounds):
+                for data_file in files:
+                    data_file.write(os.urandom(chunk))
+                    data_file.flush()
+        finally:
+            for data_file in files:
+                data_file.close()
+        for n in range(0, file_count, 2):
+            os.remove(os.path.join(mount_point, f"file_{n}"))
+    finally:
+        subprocess.run(['umount', mount_point], capture_output=True)
+    return True
+
+# --- Targets ---
+
+def attach_loop_device(path, read_only=False):
+    """Attaches `path` to a free loop device and returns it, or None if unavailable."""
+    command = ['losetup', '-f', '--show'] + (['-r'] if read_only else []) + [path]
+    try:
+        result = subprocess.run(command, capture_output=True, text=True)
+    except FileNotFoundError:
+        return None
+    return result.stdout.strip() if result.returncode == 0 else None
+
+def detach_loop_device(device):
+    """Detaches a loop device created by attach_loop_device."""
+    subprocess.run(['losetup', '-d', device], capture_output=True)
+
+def drop_caches():
+    """Flushes dirty pages and drops the page cache so runs start cold."""
+    os.sync()
+    try:
+        with open('/proc/sys/vm/drop_caches', 'w') as caches:
+            caches.write('3\n')
+    except OSError:
+        pass
+
+# --- Measurement ---
+
+def run_in_child(function, *args):
+    """
+    Runs `function(*args)` in a forked child and returns its result as a bool.
+    Used for image creation so its buffers never grow the parent that forks
+    every measured run.
+    """
+    pid = os.fork()
+    if pid == 0:
+        try:
+            ok = function(*args)
+        except BaseException:
+            ok = False
+        os._exit(0 if ok is not False else 1)
+    _, status = os.waitpid(pid, 0)
+    return os.waitstatus_to_exitcode(status) == 0
+
+def read_peak_rss_kb(pid):
+    """Returns VmHWM (peak RSS) of a running process in kB, or None if it is gone."""
+    try:
+        with open(f"/proc/{pid}/status") as status:
+            for line in status:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1])
+    except (OSError, ValueError):
+        pass
+    return None
+
+def watch_child_peak_rss(stop_event, peaks, interval=0.005):
+    """
+    Records the peak RSS of each direct child (the dd processes) in `peaks`
+    until `stop_event` is set. RUSAGE_CHILDREN can't be used for this: Linux
+    carries the forking interpreter's RSS over into an exec'd child's maxrss,
+    while VmHWM starts fresh with the new program.
+    """
+    pid = os.getpid()
+    own_executable = os.readlink('/proc/self/exe')
+    while not stop_event.is_set():
+        try:
+            with open(f"/proc/{pid}/task/{pid}/children") as children:
+                child_pids = children.read().split()
+        except OSError:
+            return
+        for child_pid in child_pids:
+            try:
+                # Until it execs, a child still reports the interpreter's memory
+                if os.readlink(f"/proc/{child_pid}/exe") == own_executable:
+                    continue
+            except OSError:
+                continue
+            peak = read_peak_rss_kb(child_pid)
+            if peak is not None:
+                peaks[child_pid] = max(peak, peaks.get(child_pid, 0))
+        stop_event.wait(interval)
+
+def measure(function, args, size, verbose=False):
+    """
+    Runs `function(*args)` in a forked child and returns its metrics, or None
+    if it failed. CPU time and peak RSS are those of the processes the data
+    path spawns (dd), not of the Python interpreter driving them; the child
+    collects them and sends them back through a pipe.
+    """
+    drop_caches()
+    read_fd, write_fd = os.pipe()
+    start_time = time.perf_counter()
+    pid = os.fork()
+    if pid == 0:
+        os.close(read_fd)
+        if not verbose:
+            devnull = os.open(os.devnull, os.O_WRONLY)
+            os.dup2(devnull, 1)
+            os.dup2(devnull, 2)
+        try:
+            stop_event = threading.Event()
+            peaks = {}
+            watcher = threading.Thread(target=watch_child_peak_rss, args=(stop_event, peaks), daemon=True)
+            watcher.start()
+            try:
+                ok = function(*args)
+            finally:
+                stop_event.set()
+                watcher.join()
+            usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+            os.write(write_fd, json.dumps({
+                'cpu_seconds': usage.ru_utime + usage.ru_stime,
+                # Falls back to the (interpreter inflated) rusage value if every child was too short-lived to sample
+                'peak_rss_kb': max(peaks.values()) if peaks else usage.ru_maxrss,
+            }).encode())
+        except BaseException:
+            ok = False
+        os._exit(0 if ok else 1)
+    os.close(write_fd)
+    with os.fdopen(read_fd, 'rb') as pipe:
+        child_usage = pipe.read()
+    _, status = os.waitpid(pid, 0)
+    duration = time.perf_counter() - start_time
+    if os.waitstatus_to_exitcode(status) != 0 or not child_usage:
+        return None
+    metrics = json.loads(child_usage)
+    metrics['throughput_mbps'] = size / (1024 * 1024) / duration
+    return metrics
+
+def summarize(runs):
+    """Combines repeated runs: median throughput and CPU time, maximum peak RSS."""
+    return {
+        'throughput_mbps': statistics.median(run['throughput_mbps'] for run in runs),
+        'cpu_seconds': statistics.median(run['cpu_seconds'] for run in runs),
+        'peak_rss_kb': max(run['peak_rss_kb'] for run in runs),
+    }
+
+def run_data_path(data_path, image, target, work_dir):
+    """Returns (function, args) running one data path for an image/target pair."""
+    if data_path == 'backup':
+        return disk_tool.backup_to_image, (image, os.path.join(work_dir, 'backup_output.img'))
+    if data_path == 'restore':
+        return disk_tool.restore_from_image, (image, target)
+    if data_path == 'usb':
+        return disk_tool.write_iso_to_usb, (image, target)
+    return disk_tool.wipe_device, (target,)
+
+def result_names(paths, images):
+    """
+    Returns the result names a run of `paths` x `images` produces. Wipe doesn't
+    read an image, so it is run once per target as 'wipe/target'.
+    """
+    names = [f"{data_path}/{kind}" for kind in images for data_path in paths if data_path != 'wipe']
+    if 'wipe' in paths:
+        names.append(WIPE_RESULT_NAME)
+    return names
+
+def measure_data_path(name, function, call_args, args, size, work_dir):
+    """Runs one data path `args.repeat` times and returns the summary, or None if a run failed."""
+    runs = []
+    for _ in range(args.repeat):
+        metrics = measure(function, call_args, size, args.verbose)
+        if metrics is None:
+            print(f"  {name}: FAILED")
+            return None
+        runs.append(metrics)
+        backup_output = os.path.join(work_dir, 'backup_output.img')
+        if os.path.exists(backup_output):
+            os.remove(backup_output)
+    summary = summarize(runs)
+    print(f"  {name}: {summary['throughput_mbps']:.1f} MB/s")
+    return summary
+
+def run_suite(args, work_dir):
+    """Builds the images and targets, runs every data path and returns the metrics."""
+    size = args.size_mb * 1024 * 1024
+    use_loop = not args.no_loop
+    loop_devices = []
+    results = {}
+
+    def attach(path, read_only=False):
+        device = attach_loop_device(path, read_only) if use_loop else None
+        if device:
+            loop_devices.append(device)
+        return device or path
+
+    def detach(*devices):
+        for device in devices:
+            if device in loop_devices:
+                detach_loop_device(device)
+                loop_devices.remove(device)
+
+    image_paths = [data_path for data_path in args.paths if data_path != 'wipe']
+    try:
+        for kind in (args.images if image_paths else []):
+            image_file = os.path.join(work_dir, f"{kind}.img")
+            print(f"Creating {args.size_mb} MB '{kind}' image...")
+            if kind == 'fragmented':
+                if not run_in_child(create_fragmented_image, image_file, size, work_dir):
+                    print("  FAILED: needs mkfs.ext4 and loop mounting.")
+                    results.update({f"{data_path}/{kind}": None for data_path in image_paths})
+                    continue
+            else:
+                run_in_child({'zero': create_zero_image, 'random': create_random_image,
+                              'mixed': create_mixed_image}[kind], image_file, size)
+
+            target_file = os.path.join(work_dir, 'target.img')
+            create_zero_image(target_file, size)
+            image = attach(image_file, read_only=True)
+            target = attach(target_file)
+
+            for data_path in image_paths:
+                name = f"{data_path}/{kind}"
+                function, call_args = run_data_path(data_path, image, target, work_dir)
+                results[name] = measure_data_path(name, function, call_args, args, size, work_dir)
+
+            detach(image, target)
+            os.remove(image_file)
+            os.remove(target_file)
+
+        if 'wipe' in args.paths:
+            print(f"Wiping a {args.size_mb} MB target...")
+            target_file = os.path.join(work_dir, 'target.img')
+            create_zero_image(target_file, size)
+            target = attach(target_file)
+            function, call_args = run_data_path('wipe', None, target, work_dir)
+            results[WIPE_RESULT_NAME] = measure_data_path(WIPE_RESULT_NAME, function, call_args, args, size, work_dir)
+            detach(target)
+            os.remove(target_file)
+    finally:
+        for device in loop_devices:
+            detach_loop_device(device)
+    return results
+
+# --- Regression Check ---
+
+def find_regressions(results, baseline, threshold, size_mb):
+    """
+    Returns a list of (name, metric, baseline value, current value) regressions.
+    A metric regresses when it is worse by more than `threshold` (relative) and
+    by more than MIN_ABSOLUTE_CHANGE. Failed runs are reported by find_failures.
+    """
+    regressions = []
+    for name, metrics in results.items():
+        reference = baseline.get(name)
+        if not reference or metrics is None:
+            continue
+        for metric, better in TRACKED_METRICS.items():
+            old, new = reference.get(metric), metrics[metric]
+            if not old:
+                continue
+            change = old - new if better == 'higher' else new - old
+            absolute_change = size_mb / new - size_mb / old if metric == 'throughput_mbps' else change
+            if change > old * threshold and absolute_change > MIN_ABSOLUTE_CHANGE[metric]:
+                regressions.append((name, metric, old, new))
+    return regressions
+
+def find_failures(results, baseline, expected_names):
+    """
+    Returns the names of data paths that failed in this run, plus those that
+    the baseline has for the selected paths/images but this run did not produce.
+    """
+    failures = [name for name, metrics in results.items() if metrics is None]
+    failures += [name for name in baseline if name in expected_names and name not in results]
+    return failures
+
+def print_results(results, baseline):
+    """Prints a table of the results next to the baseline throughput."""
+    print(f"\n{'Data path':<22} {'MB/s':>10} {'Baseline':>10} {'CPU s':>8} {'Peak RSS MB':>12}")
+    print("-" * 66)
+    for name, metrics in results.items():
+        if metrics is None:
+            print(f"{name:<22} {'FAILED':>10}")
+            continue
+        reference = (baseline.get(name) or {}).get('throughput_mbps')
+        print(f"{name:<22} {metrics['throughput_mbps']:>10.1f} "
+              f"{f'{reference:.1f}' if reference else '-':>10} "
+              f"{metrics['cpu_seconds']:>8.2f} {metrics['peak_rss_kb'] / 1024:>12.1f}")
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description="Benchmark/regression suite for disk_tool.py data paths.")
+    parser.add_argument('--size-mb', type=int, default=256, help="Size of each synthetic image (default: 256)")
+    parser.add_argument('--repeat', type=int, default=3, help="Runs per data path and image (default: 3)")
+    parser.add_argument('--paths', nargs='+', choices=DATA_PATHS, default=DATA_PATHS, help="Data paths to run")
+    parser.add_argument('--images', nargs='+', choices=IMAGE_KINDS, default=IMAGE_KINDS, help="Image kinds to use")
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE, help=f"Baseline file (default: {DEFAULT_BASELINE})")
+    parser.add_argument('--update-baseline', action='store_true', help="Store the results as the new baseline")
+    parser.add_argument('--threshold', type=float, default=0.15,
+                        help="Allowed relative regression per metric (default: 0.15 = 15%%)")
+    parser.add_argument('--output', help="Also write the results as JSON to this file")
+    parser.add_argument('--no-loop', action='store_true', help="Use plain files instead of loop devices")
+    parser.add_argument('--work-dir', help="Directory for the temporary images (default: system temp dir)")
+    parser.add_argument('--verbose', action='store_true', help="Show the output of the data paths")
+    return parser.parse_args()
+
+def main():
+    args = parse_arguments()
+    if not disk_tool.is_root():
+        print("Error: The benchmark suite requires root privileges. Please run it with 'sudo'.")
+        return 2
+    if args.size_mb < 1 or args.repeat < 1:
+        print("Error: --size-mb and --repeat must be at least 1.")
+        return 2
+    if not args.update_baseline and (args.size_mb < MIN_COMPARE_SIZE_MB or args.repeat < MIN_COMPARE_REPEAT):
+        print(f"Error: Comparing against a baseline needs --size-mb >= {MIN_COMPARE_SIZE_MB} and "
+              f"--repeat >= {MIN_COMPARE_REPEAT}; smaller runs are dominated by noise.")
+        return 2
+
+    work_dir = tempfile.mkdtemp(prefix='disk_tool_bench_', dir=args.work_dir)
+    try:
+        results = run_suite(args, work_dir)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    baseline_report = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as baseline_file:
+            baseline_report = json.load(baseline_file)
+    baseline = baseline_report.get('metrics', {})
+    print_results(results, baseline)
+
+    report = {'size_mb': args.size_mb, 'repeat': args.repeat, 'metrics': results}
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            json.dump(report, output_file, indent=2)
+
+    if args.update_baseline:
+        with open(args.baseline, 'w') as baseline_file:
+            json.dump(report, baseline_file, indent=2)
+        print(f"\nBaseline written to '{args.baseline}'.")
+        return 0 if all(results.values()) else 1
+
+    if not baseline:
+        print(f"\nNo baseline found at '{args.baseline}'. Run with --update-baseline to create one.")
+        return 0 if all(results.values()) else 1
+
+    if baseline_report.get('size_mb') != args.size_mb:
+        print(f"\nError: The baseline was recorded with --size-mb {baseline_report.get('size_mb')}; "
+              f"compare with the same size.")
+        return 2
+
+    expected_names = set(result_names(args.paths, args.images))
+    regressions = find_regressions(results, baseline, args.threshold, args.size_mb)
+    failures = find_failures(results, baseline, expected_names)
+    for name, metric, old, new in regressions:
+        print(f"REGRESSION {name} {metric}: {old} -> {new}")
+    for name in failures:
+        print(f"FAILED {name}")
+    if regressions or failures:
+        return 1
+    print(f"\nNo regressions beyond {args.threshold:.0%}.")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -2,27 +2,57 @@ import subprocess
 import os
 import sys
 import time
+import threading
+import re
+import math
+import shutil
+import stat
+import json
+from concurrent.futures import ThreadPoolExecutor
+
+# mkfs commands per filesystem type, shared by the format and provisioning operations
+MKFS_COMMANDS = {
+    'fat32': 'mkfs.fat -F 32',
+    'ntfs': 'mkfs.ntfs -f', # -f for force
+    'ext4': 'mkfs.ext4 -F'  # -F for force
+}
+# Option used by each mkfs command to set the filesystem label
+MKFS_LABEL_OPTIONS = {'fat32': '-n', 'ntfs': '-L', 'ext4': '-L'}
+
+# In-memory state kept for the lifetime of the process, so repeated actions in
+# one session (see interactive_shell) don't re-run discovery commands.
+SESSION = {
+    'devices': None,      # (topology signature, lsblk output)
+    'smart': {},          # (smartctl args, device) -> (timestamp, output)
+    'history': [],        # Actions run: {'action', 'started', 'duration', 'status'}
+}
+SMART_CACHE_TTL = 300 # Seconds before a cached S.M.A.R.T. result is re-read
+
+_is_root = None
 
 # --- Helper Functions for CLI Operations ---
 
-def run_command(command, sudo_required=True, capture_output=True, text=True, check=True):
+def is_root():
+    """Returns True if running as root (checked once per process)."""
+    global _is_root
+    if _is_root is None:
+        _is_root = os.geteuid() == 0
+    return _is_root
+
+def run_command(command, sudo_required=True, capture_output=True, text=True, check=True, input_text=None):
     """
-    Executes a shell command.
+    Executes a shell command. `input_text` is fed to the command's stdin.
     """
-    if sudo_required and os.geteuid() != 0:
+    if sudo_required and not is_root():
         print("Error: This operation requires root privileges. Please run the script with 'sudo'.")
         sys.exit(1)
 
     try:
-        cmd_with_sudo = command[:] # Make a copy
-        if sudo_required and cmd_with_sudo[0] != 'sudo': # Add sudo if not already there
-            cmd_with_sudo.insert(0, 'sudo')
-
         # For dd with status=progress, we don't want to capture output directly for real-time updates
-        if 'status=progress' in ' '.join(cmd_with_sudo):
-            result = subprocess.run(cmd_with_sudo, capture_output=False, check=check)
+        if 'status=progress' in ' '.join(command):
+            result = subprocess.run(command, capture_output=False, check=check)
         else:
-            result = subprocess.run(cmd_with_sudo, capture_output=capture_output, text=text, check=check)
+            result = subprocess.run(command, capture_output=capture_output, text=text, check=check, input=input_text)
         return result
     except subprocess.CalledProcessError as e:
         print(f"Error executing command: {' '.join(command)}")
@@ -36,17 +66,50 @@ def run_command(command, sudo_required=True, capture_output=True, text=True, che
         print(f"An unexpected error occurred: {e}")
         return None
 
-def list_storage_devices():
+def device_topology_signature():
+    """
+    Returns a cheap fingerprint of the block device topology (each device's
+    dev number and size, plus the mounts), read from /sys and /proc without
+    spawning any process. Attaching a loop device or swapping the media behind
+    the same sdX name changes the size, so the cached listing is dropped.
+    """
+    try:
+        block_devices = []
+        for name in sorted(os.listdir('/sys/class/block')):
+            attributes = [name]
+            for attribute in ('dev', 'size'):
+                try:
+                    with open(f"/sys/class/block/{name}/{attribute}") as attribute_file:
+                        attributes.append(attribute_file.read().strip())
+                except OSError:
+                    attributes.append(None) # Device went away while reading
+            block_devices.append(tuple(attributes))
+        with open('/proc/mounts') as mounts:
+            return tuple(block_devices), mounts.read()
+    except OSError:
+        return None
+
+def list_storage_devices(refresh=False):
     """
     Lists available storage devices and their partitions using lsblk.
+    The lsblk output is reused until devices or mounts change, or `refresh` is set.
     """
     print("\n--- Available Storage Devices & Partitions ---")
     print("Please carefully identify your target device (e.g., /dev/sdb, /dev/nvme0n1)")
     print("---------------------------------------------")
-    result = run_command(['lsblk', '-o', 'NAME,SIZE,TYPE,MOUNTPOINT'], sudo_required=False)
-    if result:
-        print(result.stdout)
+    signature = device_topology_signature()
+    cached = SESSION['devices']
+    if not refresh and signature is not None and cached and cached[0] == signature:
+        print(cached[1])
+        listed = True
+    else:
+        result = run_command(['lsblk', '-o', 'NAME,SIZE,TYPE,MOUNTPOINT'], sudo_required=False)
+        listed = bool(result)
+        if result:
+            SESSION['devices'] = (signature, result.stdout)
+            print(result.stdout)
     print("---------------------------------------------\n")
+    return listed
 
 def get_device_path_from_user(prompt_type="device"):
     """
@@ -117,6 +180,489 @@ def confirm_action(action_description):
         print("Action cancelled.")
         return False
 
+# --- I/O Throttling ---
+
+# Limits applied to the data copy paths (copy, backup, restore, bootable USB).
+# None means "no limit". While a job is running the limits can be changed by
+# writing to THROTTLE_CONTROL_FILE from another shell, e.g.:
+#   echo "mbps=20 iops=100" | sudo tee /run/disk_tool_throttle
+THROTTLE_SETTINGS = {
+    'mbps': None,          # Bandwidth cap in MB/s
+    'iops': None,          # Cap on block-layer requests per second (reads and writes each)
+    'ioprio_class': None,  # None, 'idle' or 'best-effort'
+    'ioprio_level': 7,     # 0 (highest) - 7 (lowest), best-effort only
+    'use_cgroup': False,   # Enforce the caps in the kernel with cgroup v2 io.max
+}
+THROTTLE_CONTROL_FILE = '/run/disk_tool_throttle'
+THROTTLE_BLOCK_SIZE = 4 * 1024 * 1024 # Same as the dd paths (bs=4M)
+DEFAULT_MAX_REQUEST_BYTES = 512 * 1024 # Typical queue/max_sectors_kb when the device is unknown
+
+_throttle_control_mtime = None
+
+# Set to stop a running token-bucket copy (e.g. on Ctrl+C)
+COPY_STOP_EVENT = threading.Event()
+
+class TokenBucket:
+    """
+    Token bucket rate limiter. `rate_getter` returns the current rate in tokens
+    per second (or None for unlimited) so the rate can change mid-transfer.
+    `poll` (optional) is called between sleep slices, e.g. to re-read the
+    control file, so a changed rate applies while a large debt is paid off.
+    """
+    MAX_SLEEP = 1.0 # Longest single sleep before the rate is looked at again
+
+    def __init__(self, rate_getter, poll=None):
+        self.rate_getter = rate_getter
+        self.poll = poll
+        self.tokens = 0.0
+        self.last_refill = time.monotonic()
+
+    def _refill(self):
+        """Adds the tokens earned since the last refill; returns the current rate."""
+        now = time.monotonic()
+        elapsed = now - self.last_refill
+        self.last_refill = now
+        rate = self.rate_getter()
+        if not rate:
+            self.tokens = 0.0
+            return None
+        # Allow bursts of up to one second worth of tokens
+        self.tokens = min(rate, self.tokens + elapsed * rate)
+        return rate
+
+    def consume(self, amount):
+        rate = self._refill()
+        if rate is None:
+            return
+        # Go into debt and sleep it off in slices, picking up rate changes in between
+        self.tokens -= amount
+        while self.tokens < 0 and not COPY_STOP_EVENT.is_set():
+            COPY_STOP_EVENT.wait(min(self.MAX_SLEEP, -self.tokens / rate)) # Wakes up early if the copy is stopped
+            if self.poll:
+                self.poll()
+            rate = self._refill()
+            if rate is None:
+                return
+
+def parse_throttle_limit(value):
+    """
+    Parses a cap from the menu or control file. Returns None (no cap) for
+    '', 'none' or 0, a positive float otherwise; raises ValueError for
+    negative, infinite or NaN values.
+    """
+    if value.strip().lower() in ('', 'none'):
+        return None
+    number = float(value)
+    if not math.isfinite(number) or number < 0:
+        raise ValueError(f"invalid limit '{value}'")
+    return number or None
+
+def throttling_active():
+    """Returns True if a bandwidth or IOPS cap is configured."""
+    return bool(THROTTLE_SETTINGS['mbps'] or THROTTLE_SETTINGS['iops'])
+
+def reload_throttle_control_file():
+    """
+    Re-reads THROTTLE_CONTROL_FILE if it changed since the last check.
+    Accepts "mbps=<n> iops=<n>" (0 or 'none' removes a cap).
+    Returns True if the limits were updated.
+    """
+    global _throttle_control_mtime
+    try:
+        mtime = os.stat(THROTTLE_CONTROL_FILE).st_mtime
+    except OSError:
+        return False
+    if mtime == _throttle_control_mtime:
+        return False
+    _throttle_control_mtime = mtime
+
+    try:
+        with open(THROTTLE_CONTROL_FILE) as control_file:
+            tokens = control_file.read().split()
+    except OSError:
+        return False
+
+    updated = False
+    for token in tokens:
+        key, _, value = token.partition('=')
+        if key not in ('mbps', 'iops'):
+            continue
+        try:
+            THROTTLE_SETTINGS[key] = parse_throttle_limit(value)
+            updated = True
+        except ValueError:
+            print(f"\nIgnoring invalid throttle value '{token}' in {THROTTLE_CONTROL_FILE}.")
+    if updated:
+        print(f"\nThrottle updated: {describe_throttle()}")
+    return updated
+
+def _snapshot_throttle_control_file():
+    """Remembers the control file's mtime so only changes made during a job apply."""
+    global _throttle_control_mtime
+    try:
+        _throttle_control_mtime = os.stat(THROTTLE_CONTROL_FILE).st_mtime
+    except OSError:
+        _throttle_control_mtime = None
+
+def describe_throttle():
+    """Returns a one-line, human readable summary of THROTTLE_SETTINGS."""
+    mbps = THROTTLE_SETTINGS['mbps']
+    iops = THROTTLE_SETTINGS['iops']
+    ioprio = THROTTLE_SETTINGS['ioprio_class'] or 'default'
+    if THROTTLE_SETTINGS['ioprio_class'] == 'best-effort':
+        ioprio += f" (level {THROTTLE_SETTINGS['ioprio_level']})"
+    return (f"bandwidth={f'{mbps:g} MB/s' if mbps else 'unlimited'}, "
+            f"iops={f'{iops:g}' if iops else 'unlimited'}, "
+            f"ioprio={ioprio}, cgroup={'on' if THROTTLE_SETTINGS['use_cgroup'] else 'off'}")
+
+def ionice_arguments():
+    """Returns the ionice class/level arguments for the configured I/O priority."""
+    if THROTTLE_SETTINGS['ioprio_class'] == 'idle':
+        return ['-c', '3']
+    if THROTTLE_SETTINGS['ioprio_class'] == 'best-effort':
+        return ['-c', '2', '-n', str(THROTTLE_SETTINGS['ioprio_level'])]
+    return []
+
+def block_device_numbers(path):
+    """
+    Returns the "MAJ:MIN" of the whole disk backing `path` (a device node or a
+    file on a mounted filesystem), or None. cgroup io.max only accepts disks.
+    """
+    try:
+        st = os.stat(path if os.path.exists(path) else (os.path.dirname(path) or '.'))
+    except OSError:
+        return None
+    dev = st.st_rdev if (st.st_mode & 0o170000) == 0o060000 else st.st_dev
+    sys_path = f"/sys/dev/block/{os.major(dev)}:{os.minor(dev)}"
+    if not os.path.exists(sys_path):
+        return None
+    if os.path.exists(os.path.join(sys_path, 'partition')):
+        try:
+            with open(os.path.join(os.path.realpath(sys_path), '..', 'dev')) as dev_file:
+                return dev_file.read().strip()
+        except OSError:
+            return None
+    return f"{os.major(dev)}:{os.minor(dev)}"
+
+def max_request_bytes(*paths):
+    """
+    Returns the largest request the block layer issues for the first of `paths`
+    backed by a disk (queue/max_sectors_kb), so the token-bucket IOPS cap counts
+    the same requests as cgroup io.max does.
+    """
+    for path in paths:
+        device = block_device_numbers(path)
+        if device is None:
+            continue
+        try:
+            with open(f"/sys/dev/block/{device}/queue/max_sectors_kb") as max_sectors:
+                return int(max_sectors.read()) * 1024
+        except (OSError, ValueError):
+            continue
+    return DEFAULT_MAX_REQUEST_BYTES
+
+def find_cgroup2_mount():
+    """Returns the cgroup v2 mount point, or None if cgroup v2 is not mounted."""
+    try:
+        with open('/proc/mounts') as mounts:
+            for line in mounts:
+                fields = line.split()
+                if len(fields) > 2 and fields[2] == 'cgroup2':
+                    return fields[1]
+    except OSError:
+        pass
+    return None
+
+def write_io_max(cgroup_path, devices):
+    """Writes the current THROTTLE_SETTINGS limits to the cgroup's io.max."""
+    mbps = THROTTLE_SETTINGS['mbps']
+    iops = THROTTLE_SETTINGS['iops']
+    # Round up: io.max rejects 0, and a fractional cap should not become unlimited
+    bps = str(max(1, math.ceil(mbps * 1024 * 1024))) if mbps else 'max'
+    iops_value = str(max(1, math.ceil(iops))) if iops else 'max'
+    for device in devices:
+        with open(os.path.join(cgroup_path, 'io.max'), 'w') as io_max:
+            io_max.write(f"{device} rbps={bps} wbps={bps} riops={iops_value} wiops={iops_value}\n")
+
+def create_io_cgroup(devices):
+    """
+    Creates a temporary cgroup v2 group with io.max limits for `devices`.
+    The memory controller is enabled too: without it, buffered writeback is
+    charged to the root cgroup and the wbps/wiops caps would not apply.
+    Returns the cgroup path, or None if cgroup v2 io control is unavailable.
+    """
+    cgroup_root = find_cgroup2_mount()
+    if cgroup_root is None or not devices:
+        return None
+    cgroup_path = os.path.join(cgroup_root, f"disk_tool_{os.getpid()}")
+    try:
+        for controller in ('+io', '+memory'):
+            with open(os.path.join(cgroup_root, 'cgroup.subtree_control'), 'w') as subtree_control:
+                subtree_control.write(controller)
+        os.makedirs(cgroup_path, exist_ok=True)
+        write_io_max(cgroup_path, devices)
+    except OSError as e:
+        print(f"Could not set up cgroup io.max: {e}")
+        remove_io_cgroup(cgroup_path)
+        return None
+    return cgroup_path
+
+def remove_io_cgroup(cgroup_path):
+    """Removes a cgroup created by create_io_cgroup (it must be empty)."""
+    try:
+        os.rmdir(cgroup_path)
+    except OSError:
+        pass
+
+def throttled_copy_file(source, destination, buckets, progress=None, sync=False, sparse=False):
+    """
+    Copies `source` to `destination` in THROTTLE_BLOCK_SIZE chunks, consuming
+    from the (bandwidth, iops) token `buckets` before each write. Each chunk is
+    charged as the number of block-layer requests it splits into.
+    `progress` is a dict shared across files for progress reporting.
+    With `sparse`, holes in `source` are skipped instead of written as zeros
+    (only safe when `destination` is a new regular file).
+    """
+    byte_bucket, iops_bucket = buckets
+    if progress is None:
+        start = time.monotonic()
+        progress = {'copied': 0, 'start': start, 'last_report': start}
+    request_size = max_request_bytes(destination, source)
+
+    with open(source, 'rb', buffering=0) as src, open(destination, 'wb', buffering=0) as dst:
+        size = os.fstat(src.fileno()).st_size
+        while True:
+            if sparse:
+                try:
+                    data_start = os.lseek(src.fileno(), src.tell(), os.SEEK_DATA)
+                except OSError: # ENXIO: only a hole is left
+                    data_start = size
+                data_end = os.lseek(src.fileno(), data_start, os.SEEK_HOLE) if data_start < size else size
+                src.seek(data_start)
+                dst.seek(data_start)
+                chunk = src.read(min(THROTTLE_BLOCK_SIZE, data_end - data_start)) if data_start < data_end else b''
+            else:
+                chunk = src.read(THROTTLE_BLOCK_SIZE)
+            if not chunk:
+                break
+            if COPY_STOP_EVENT.is_set():
+                raise InterruptedError("copy stopped")
+            byte_bucket.consume(len(chunk))
+            iops_bucket.consume(-(-len(chunk) // request_size))
+            dst.write(chunk)
+            progress['copied'] += len(chunk)
+
+            now = time.monotonic()
+            if now - progress['last_report'] >= 1:
+                progress['last_report'] = now
+                reload_throttle_control_file()
+                elapsed = now - progress['start']
+                rate = progress['copied'] / (1024 * 1024) / elapsed if elapsed else 0
+                print(f"\r{progress['copied']} bytes ({progress['copied'] / (1024 * 1024):.0f} MB) copied, "
+                      f"{elapsed:.0f} s, {rate:.1f} MB/s   ", end='', flush=True)
+        if sparse:
+            dst.truncate(size)
+        if sync:
+            os.fsync(dst.fileno())
+    return progress
+
+def make_token_buckets():
+    """Returns (bandwidth, iops) token buckets reading the live THROTTLE_SETTINGS."""
+    return (TokenBucket(lambda: THROTTLE_SETTINGS['mbps'] and THROTTLE_SETTINGS['mbps'] * 1024 * 1024,
+                        poll=reload_throttle_control_file),
+            TokenBucket(lambda: THROTTLE_SETTINGS['iops'], poll=reload_throttle_control_file))
+
+def throttled_copy_tree(source, destination):
+    """
+    Token-bucket limited equivalent of 'cp -a source destination'.
+    Regular files are copied sparsely; FIFOs, sockets and device nodes are
+    recreated rather than read. Hard links are not preserved (each link becomes
+    its own file); enable the cgroup option to throttle a real 'cp -a' instead.
+    """
+    buckets = make_token_buckets()
+    start = time.monotonic()
+    progress = {'copied': 0, 'start': start, 'last_report': start}
+
+    def remove_existing(dst):
+        # Like 'cp -a', replace an existing non-directory destination
+        if os.path.lexists(dst) and not (os.path.isdir(dst) and not os.path.islink(dst)):
+            os.unlink(dst)
+
+    def copy_entry(src, dst):
+        st = os.lstat(src)
+        remove_existing(dst)
+        if stat.S_ISREG(st.st_mode):
+            throttled_copy_file(src, dst, buckets, progress, sparse=True)
+        elif stat.S_ISFIFO(st.st_mode):
+            os.mkfifo(dst)
+        else: # Character/block devices and sockets
+            os.mknod(dst, st.st_mode, st.st_rdev)
+        # chown clears setuid/setgid bits, so restore the mode afterwards with copystat
+        os.chown(dst, st.st_uid, st.st_gid)
+        shutil.copystat(src, dst)
+
+    if os.path.isdir(destination):
+        destination = os.path.join(destination, os.path.basename(source.rstrip('/')))
+    if os.path.isdir(source) and not os.path.islink(source):
+        # copytree creates symlinks itself and fails if one already exists
+        for root, dirs, files in os.walk(source):
+            for name in dirs + files:
+                if os.path.islink(os.path.join(root, name)):
+                    remove_existing(os.path.join(destination, os.path.relpath(os.path.join(root, name), source)))
+        shutil.copytree(source, destination, symlinks=True, copy_function=copy_entry, dirs_exist_ok=True)
+        # copytree leaves directories and symlinks owned by us
+        for root, dirs, files in os.walk(source):
+            for name in [''] + dirs + files:
+                src_path = os.path.join(root, name)
+                st = os.lstat(src_path)
+                if not (stat.S_ISDIR(st.st_mode) or stat.S_ISLNK(st.st_mode)):
+                    continue
+                dst_path = os.path.join(destination, os.path.relpath(src_path, source))
+                os.lchown(dst_path, st.st_uid, st.st_gid)
+                if stat.S_ISDIR(st.st_mode):
+                    os.chmod(dst_path, stat.S_IMODE(st.st_mode))
+    elif os.path.islink(source):
+        remove_existing(destination)
+        os.symlink(os.readlink(source), destination)
+        st = os.lstat(source)
+        os.lchown(destination, st.st_uid, st.st_gid)
+    else:
+        copy_entry(source, destination)
+
+def run_with_ioprio(function, *args):
+    """
+    Runs `function(*args)` in a worker thread with the configured I/O priority
+    (ioprio is per thread on Linux, so the main thread is left untouched).
+    Returns True if the function completed without raising.
+    """
+    outcome = {'ok': False}
+
+    def worker():
+        ionice_args = ionice_arguments()
+        if ionice_args:
+            run_command(['ionice'] + ionice_args + ['-p', str(threading.get_native_id())], sudo_required=False)
+        try:
+            function(*args)
+            outcome['ok'] = True
+        except OSError as e:
+            if not COPY_STOP_EVENT.is_set():
+                print(f"\nError during throttled copy: {e}")
+
+    COPY_STOP_EVENT.clear()
+    worker_thread = threading.Thread(target=worker, daemon=True)
+    worker_thread.start()
+    try:
+        worker_thread.join()
+    except KeyboardInterrupt:
+        # Don't leave the copy writing in the background after Ctrl+C
+        COPY_STOP_EVENT.set()
+        worker_thread.join()
+        print("\nCopy stopped.")
+        raise
+    print()
+    return outcome['ok']
+
+def run_throttled_transfer(command, source, destination, python_copy, capture_output=False):
+    """
+    Runs a data copy `command` (dd/cp) honouring THROTTLE_SETTINGS.
+    - No rate caps: runs `command` under ionice (if an I/O priority is set).
+    - cgroup enabled: runs `command` inside a cgroup v2 group with io.max limits.
+    - Otherwise: runs `python_copy` (a token-bucket limited copy) instead.
+    Returns True on success.
+    """
+    ionice_args = ionice_arguments()
+    if ionice_args:
+        command = ['ionice'] + ionice_args + command
+
+    # Without a cap or the cgroup option nothing watches the control file, so
+    # caps cannot be added to the job once it has started.
+    if not throttling_active() and not THROTTLE_SETTINGS['use_cgroup']:
+        result = run_command(command, sudo_required=True, capture_output=capture_output, check=False)
+        return bool(result and result.returncode == 0)
+
+    _snapshot_throttle_control_file()
+    print(f"Throttling enabled: {describe_throttle()}")
+    print(f"Adjust while running by writing 'mbps=<n> iops=<n>' to {THROTTLE_CONTROL_FILE}.")
+
+    if THROTTLE_SETTINGS['use_cgroup']:
+        devices = sorted({d for d in (block_device_numbers(source), block_device_numbers(destination)) if d})
+        cgroup_path = create_io_cgroup(devices)
+        if cgroup_path:
+            stop_event = threading.Event()
+
+            def watch_control_file():
+                while not stop_event.wait(1):
+                    try:
+                        if reload_throttle_control_file():
+                            write_io_max(cgroup_path, devices)
+                    except (OSError, ValueError) as e:
+                        print(f"\nCould not update cgroup io.max: {e}")
+
+            watcher = threading.Thread(target=watch_control_file, daemon=True)
+            watcher.start()
+            # Join the cgroup from inside the child before exec'ing the real command
+            cgroup_command = ['sh', '-c', 'echo $$ > "$0" && exec "$@"',
+                              os.path.join(cgroup_path, 'cgroup.procs')] + command
+            try:
+                result = run_command(cgroup_command, sudo_required=True, capture_output=capture_output, check=False)
+            finally:
+                stop_event.set()
+                watcher.join()
+                remove_io_cgroup(cgroup_path)
+            return bool(result and result.returncode == 0)
+        print("cgroup v2 io.max is not available, falling back to token-bucket throttling.")
+        if not throttling_active():
+            result = run_command(command, sudo_required=True, capture_output=capture_output, check=False)
+            return bool(result and result.returncode == 0)
+
+    return run_with_ioprio(python_copy, source, destination)
+
+def run_dd_copy(source, destination, extra_args=(), sync=False):
+    """
+    Runs 'dd if=<source> of=<destination> bs=4M status=progress' (plus `extra_args`),
+    throttled according to THROTTLE_SETTINGS. Returns True on success.
+    """
+    command = ['dd', f'if={source}', f'of={destination}', 'bs=4M', 'status=progress'] + list(extra_args)
+    return run_throttled_transfer(command, source, destination,
+                                  lambda src, dst: throttled_copy_file(src, dst, make_token_buckets(), sync=sync))
+
+# --- Data Paths ---
+# Non-interactive cores of the dd based operations, shared by the menu actions
+# below and by benchmark_suite.py.
+
+def backup_to_image(source_path, image_path):
+    """Copies a partition/disk bit-for-bit to an image file. Returns True on success."""
+    return run_dd_copy(source_path, image_path)
+
+def restore_from_image(image_path, destination_path):
+    """Writes an image file back onto a partition/disk. Returns True on success."""
+    return run_dd_copy(image_path, destination_path)
+
+def write_iso_to_usb(iso_path, usb_device):
+    """Writes an ISO image to a USB device with synchronous writes. Returns True on success."""
+    return run_dd_copy(iso_path, usb_device, extra_args=['oflag=sync'], sync=True)
+
+def device_size_bytes(path):
+    """Returns the size in bytes of a block device or file, or None if unknown."""
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError:
+        return None
+    try:
+        return os.lseek(fd, 0, os.SEEK_END)
+    finally:
+        os.close(fd)
+
+def wipe_device(device):
+    """Overwrites a whole device (or file) with zeros. Returns True on success."""
+    command = ['dd', 'if=/dev/zero', f'of={device}', 'bs=4M', 'status=progress']
+    size = device_size_bytes(device)
+    if size:
+        # Stop exactly at the end instead of failing with "No space left on device"
+        command += [f'count={size}', 'iflag=count_bytes']
+    result = run_command(command, sudo_required=True, capture_output=False, check=False)
+    return bool(result and result.returncode == 0)
+
 # --- Main Operations ---
 
 def copy_data():
@@ -132,11 +678,13 @@ def copy_data():
 
     # -a for archive mode (preserves permissions, timestamps, etc.)
     # -v for verbose output
-    result = run_command(['cp', '-av', source, destination], sudo_required=True)
-    if result:
+    if run_throttled_transfer(['cp', '-av', source, destination], source, destination,
+                              throttled_copy_tree, capture_output=True):
         print("Data copied successfully.")
+        return True
     else:
         print("Data copy failed.")
+        return False
 
 def delete_data():
     """Deletes files/directories/full device data."""
@@ -162,8 +710,10 @@ def delete_data():
             result = run_command(['rm', '-rf', path_to_delete], sudo_required=True)
             if result:
                 print("Data deleted successfully.")
+                return True
             else:
                 print("Data deletion failed.")
+                return False
         else:
             print("Deletion cancelled.")
     elif delete_choice == '2':
@@ -175,11 +725,12 @@ def delete_data():
         if confirm_action(f"PERMANENTLY WIPE ALL DATA from '{device_to_wipe}' (zeros out the entire disk)"):
             print(f"Wiping all data from '{device_to_wipe}'. This will take a long time for large drives...")
             # dd if=/dev/zero of=/dev/sdb bs=4M status=progress
-            result = run_command(['dd', 'if=/dev/zero', f'of={device_to_wipe}', 'bs=4M', 'status=progress'], sudo_required=True, capture_output=False, check=False)
-            if result and result.returncode == 0:
+            if wipe_device(device_to_wipe):
                 print(f"Successfully wiped '{device_to_wipe}'.")
+                return True
             else:
                 print(f"Failed to wipe '{device_to_wipe}'.")
+                return False
         else:
             print("Device wipe cancelled.")
     else:
@@ -206,9 +757,9 @@ def format_disk():
         return
 
     filesystem_map = {
-        '1': {'type': 'fat32', 'command': 'mkfs.fat -F 32'},
-        '2': {'type': 'ntfs', 'command': 'mkfs.ntfs -f'}, # -f for force
-        '3': {'type': 'ext4', 'command': 'mkfs.ext4 -F'}  # -F for force
+        '1': {'type': 'fat32', 'command': MKFS_COMMANDS['fat32']},
+        '2': {'type': 'ntfs', 'command': MKFS_COMMANDS['ntfs']},
+        '3': {'type': 'ext4', 'command': MKFS_COMMANDS['ext4']}
     }
 
     if fs_choice in filesystem_map:
@@ -229,8 +780,10 @@ def format_disk():
 
             if result and result.returncode == 0:
                 print(f"'{device_to_format}' successfully formatted to {fs_type}.")
+                return True
             else:
                 print(f"Formatting failed for '{device_to_format}'.")
+                return False
         # else: confirm_action already printed cancellation message
     else:
         print("Invalid filesystem choice. Returning to main menu.")
@@ -266,7 +819,7 @@ def manage_partitions():
         # else: confirm_action already printed cancellation message
     elif partition_choice == '2':
         if confirm_action(f"enter 'parted' interactive mode for {device_for_partition}"):
-            print(f"Starting 'parted {device_for_partition}'. Type 'help' for help inside parted.")in/sowmitro-halder-badhon-85764325a
+            print(f"Starting 'parted {device_for_partition}'. Type 'help' for help inside parted.")
             run_command(['parted', device_for_partition], sudo_required=True, capture_output=False) # Direct interactive mode
             print("Exited parted.")
         # else: confirm_action already printed cancellation message
@@ -277,6 +830,22 @@ def manage_partitions():
         print("Invalid choice. Returning to main menu.")
 
 
+def run_smartctl(arguments, device):
+    """
+    Runs 'smartctl <arguments> <device>' and returns its output, or None on failure.
+    Results are cached in SESSION for SMART_CACHE_TTL seconds.
+    """
+    key = (tuple(arguments), device)
+    cached = SESSION['smart'].get(key)
+    if cached and time.monotonic() - cached[0] < SMART_CACHE_TTL:
+        print(f"(cached result from {time.monotonic() - cached[0]:.0f} seconds ago, run 'refresh' in the shell to re-read)")
+        return cached[1]
+    result = run_command(['smartctl'] + list(arguments) + [device], sudo_required=True)
+    if not result:
+        return None
+    SESSION['smart'][key] = (time.monotonic(), result.stdout)
+    return result.stdout
+
 def check_disk_health():
     """
     Checks disk health using smartctl (if installed).
@@ -289,15 +858,17 @@ def check_disk_health():
 
     print(f"Checking S.M.A.R.T. health for {device_to_check}...")
     # smartctl needs to be installed (e.g., sudo apt install smartmontools)
-    result = run_command(['smartctl', '-H', device_to_check], sudo_required=True)
-    if result:
-        print(result.stdout)
+    output = run_smartctl(['-H'], device_to_check)
+    if output is not None:
+        print(output)
         # Full SMART report
         full_report = input("Do you want a full S.M.A.R.T. report? (yes/no): ").lower()
         if full_report == 'yes':
             run_command(['smartctl', '-a', device_to_check], sudo_required=True, capture_output=False)
+        return True
     else:
         print("Could not retrieve S.M.A.R.T. data. 'smartctl' might not be installed or supported for this device.")
+        return False
 
 
 def view_disk_usage():
@@ -316,7 +887,10 @@ def view_disk_usage():
         return
     elif usage_choice == '1':
         print("Filesystem Disk Space:")
-        run_command(['df', '-h'], sudo_required=False)
+        result = run_command(['df', '-h'], sudo_required=False)
+        if result:
+            print(result.stdout)
+        return bool(result)
     elif usage_choice == '2':
         path_for_du = input("Enter the path (directory or file) to check size for or type 'back' to return: ").strip().lower()
         if path_for_du == 'back':
@@ -324,9 +898,13 @@ def view_disk_usage():
             return
         if os.path.exists(path_for_du):
             print(f"Size of '{path_for_du}':")
-            run_command(['du', '-sh', path_for_du], sudo_required=False)
+            result = run_command(['du', '-sh', path_for_du], sudo_required=False)
+            if result:
+                print(result.stdout)
+            return bool(result)
         else:
             print(f"Path '{path_for_du}' does not exist.")
+            return False
     else:
         print("Invalid choice. Returning to main menu.")
 
@@ -347,8 +925,10 @@ def create_directory():
         result = run_command(['mkdir', '-p', dir_path], sudo_required=True)
         if result:
             print(f"Directory '{dir_path}' created successfully.")
+            return True
         else:
             print(f"Failed to create directory '{dir_path}'.")
+            return False
     # else: confirm_action already printed cancellation message
 
 def mount_unmount_device():
@@ -386,8 +966,10 @@ def mount_unmount_device():
             result = run_command(['mount', partition_path, mount_point], sudo_required=True)
             if result:
                 print(f"Successfully mounted '{partition_path}' to '{mount_point}'.")
+                return True
             else:
                 print("Mount failed.")
+                return False
         # else: confirm_action already printed cancellation message
     elif choice == '2':
         path_to_unmount = input("Enter the device/partition path OR mount point to unmount or type 'back' to return: ").strip().lower()
@@ -399,8 +981,10 @@ def mount_unmount_device():
             result = run_command(['umount', path_to_unmount], sudo_required=True)
             if result:
                 print(f"Successfully unmounted '{path_to_unmount}'.")
+                return True
             else:
                 print("Unmount failed.")
+                return False
         # else: confirm_action already printed cancellation message
     else:
         print("Invalid choice. Returning to main menu.")
@@ -424,7 +1008,7 @@ def backup_disk_to_image():
 
     if not os.path.isdir(os.path.dirname(destination_image_path) or '.'):
         print("Error: Destination directory does not exist.")
-        return
+        return False
 
     if confirm_action(f"backup '{source_path}' to '{destination_image_path}'"):
         # Unmount the source if it's mounted
@@ -433,11 +1017,12 @@ def backup_disk_to_image():
         
         print(f"Creating image from '{source_path}' to '{destination_image_path}'. This may take time...")
         # dd if=/dev/sdb of=/path/to/backup.img bs=4M status=progress
-        result = run_command(['dd', f'if={source_path}', f'of={destination_image_path}', 'bs=4M', 'status=progress'], sudo_required=True, capture_output=False, check=False)
-        if result and result.returncode == 0:
+        if backup_to_image(source_path, destination_image_path):
             print(f"Backup of '{source_path}' to '{destination_image_path}' completed successfully.")
+            return True
         else:
             print(f"Backup failed for '{source_path}'.")
+            return False
     # else: confirm_action already printed cancellation message
 
 def restore_image_to_disk():
@@ -451,7 +1036,7 @@ def restore_image_to_disk():
         return
     if not os.path.exists(image_path):
         print(f"Error: Image file '{image_path}' not found.")
-        return
+        return False
 
     list_storage_devices()
     destination_path = get_device_path_from_user("destination device/partition")
@@ -465,11 +1050,12 @@ def restore_image_to_disk():
 
         print(f"Restoring image '{image_path}' to '{destination_path}'. This may take time...")
         # dd if=/path/to/backup.img of=/dev/sdb bs=4M status=progress
-        result = run_command(['dd', f'if={image_path}', f'of={destination_path}', 'bs=4M', 'status=progress'], sudo_required=True, capture_output=False, check=False)
-        if result and result.returncode == 0:
+        if restore_from_image(image_path, destination_path):
             print(f"Restore of '{image_path}' to '{destination_path}' completed successfully.")
+            return True
         else:
             print(f"Restore failed for '{destination_path}'.")
+            return False
     # else: confirm_action already printed cancellation message
 
 def create_bootable_usb():
@@ -483,7 +1069,7 @@ def create_bootable_usb():
         return
     if not os.path.exists(iso_path) or not iso_path.lower().endswith('.iso'):
         print(f"Error: ISO file '{iso_path}' not found or is not an ISO file.")
-        return
+        return False
 
     list_storage_devices()
     usb_device = get_device_path_from_user("USB device (e.g., /dev/sdb)")
@@ -497,12 +1083,13 @@ def create_bootable_usb():
 
         print(f"Writing ISO '{iso_path}' to '{usb_device}'. This may take time...")
         # dd if=/path/to/image.iso of=/dev/sdb bs=4M status=progress
-        result = run_command(['dd', f'if={iso_path}', f'of={usb_device}', 'bs=4M', 'status=progress', 'oflag=sync'], sudo_required=True, capture_output=False, check=False)
-        if result and result.returncode == 0:
+        if write_iso_to_usb(iso_path, usb_device):
             print(f"Bootable USB '{usb_device}' created successfully from '{iso_path}'.")
             print("Note: You may need to sync the changes (sudo sync) or remove and re-insert the USB for it to be recognized.")
+            return True
         else:
             print(f"Failed to create bootable USB on '{usb_device}'.")
+            return False
     # else: confirm_action already printed cancellation message
 
 def format_partition():
@@ -534,9 +1121,9 @@ def format_partition():
         return
 
     filesystem_map = {
-        '1': {'type': 'fat32', 'command': 'mkfs.fat -F 32'},
-        '2': {'type': 'ntfs', 'command': 'mkfs.ntfs -f'}, # -f for force
-        '3': {'type': 'ext4', 'command': 'mkfs.ext4 -F'}  # -F for force
+        '1': {'type': 'fat32', 'command': MKFS_COMMANDS['fat32']},
+        '2': {'type': 'ntfs', 'command': MKFS_COMMANDS['ntfs']},
+        '3': {'type': 'ext4', 'command': MKFS_COMMANDS['ext4']}
     }
 
     if fs_choice in filesystem_map:
@@ -554,8 +1141,10 @@ def format_partition():
 
             if result and result.returncode == 0:
                 print(f"'{partition_to_format}' successfully formatted to {fs_type}.")
+                return True
             else:
                 print(f"Formatting failed for '{partition_to_format}'.")
+                return False
         # else: confirm_action already printed cancellation message
     else:
         print("Invalid filesystem choice. Returning to main menu.")
@@ -572,11 +1161,13 @@ def view_smart_errors():
 
     print(f"Checking S.M.A.R.T. error log for {device_to_check}...")
     # smartctl -l error /dev/sdb
-    result = run_command(['smartctl', '-l', 'error', device_to_check], sudo_required=True)
-    if result:
-        print(result.stdout)
+    output = run_smartctl(['-l', 'error'], device_to_check)
+    if output is not None:
+        print(output)
+        return True
     else:
         print("Could not retrieve S.M.A.R.T. error log. 'smartctl' might not be installed or supported for this device.")
+        return False
 
 def benchmark_disk_speed():
     """
@@ -644,6 +1235,347 @@ def benchmark_disk_speed():
         print("Note: Read test might fail if the device is not readable or already mounted.")
 
     print("\nBenchmarking complete.")
+    return bool(write_result and write_result.returncode == 0 and read_result and read_result.returncode == 0)
+
+def configure_io_throttling():
+    """
+    Configures bandwidth/IOPS caps, I/O priority and cgroup use for the copy paths.
+    """
+    while True:
+        print("\n--- I/O Throttling Settings ---")
+        print(f"Current: {describe_throttle()}")
+        print("1. Set bandwidth limit (MB/s)")
+        print("2. Set IOPS limit (block-layer requests per second, counted separately for reads and writes)")
+        print("3. Set I/O priority class (idle / best-effort)")
+        print("4. Toggle cgroup v2 io.max enforcement")
+        print("5. Clear all limits")
+        print("Type 'back' to return to main menu.")
+
+        choice = input("Enter your choice (1-5): ").strip().lower()
+
+        if choice == 'back':
+            print("Returning to main menu.")
+            return True # Settings are kept for the session
+        elif choice in ('1', '2'):
+            key = 'mbps' if choice == '1' else 'iops'
+            value = input(f"Enter the {'MB/s' if key == 'mbps' else 'IOPS'} limit (0 for unlimited): ").strip()
+            try:
+                THROTTLE_SETTINGS[key] = parse_throttle_limit(value)
+            except ValueError:
+                print("Invalid limit. Enter a positive number, or 0 for unlimited.")
+                continue
+        elif choice == '3':
+            print("1. Default (no change)")
+            print("2. Idle (only uses the disk when nothing else does)")
+            print("3. Best-effort (with a level from 0 = highest to 7 = lowest)")
+            class_choice = input("Enter your choice (1, 2, or 3): ").strip()
+            if class_choice == '1':
+                THROTTLE_SETTINGS['ioprio_class'] = None
+            elif class_choice == '2':
+                THROTTLE_SETTINGS['ioprio_class'] = 'idle'
+            elif class_choice == '3':
+                level = input("Enter the best-effort level (0-7): ").strip()
+                if level not in [str(n) for n in range(8)]:
+                    print("Invalid level.")
+                    continue
+                THROTTLE_SETTINGS['ioprio_class'] = 'best-effort'
+                THROTTLE_SETTINGS['ioprio_level'] = int(level)
+            else:
+                print("Invalid choice.")
+        elif choice == '4':
+            THROTTLE_SETTINGS['use_cgroup'] = not THROTTLE_SETTINGS['use_cgroup']
+            if THROTTLE_SETTINGS['use_cgroup']:
+                print("Jobs now run in a cgroup even without caps, so caps can be added while they run.")
+            if THROTTLE_SETTINGS['use_cgroup'] and find_cgroup2_mount() is None:
+                print("Warning: cgroup v2 is not mounted; token-bucket throttling will be used instead.")
+        elif choice == '5':
+            THROTTLE_SETTINGS.update({'mbps': None, 'iops': None, 'ioprio_class': None, 'use_cgroup': False})
+        else:
+            print("Invalid choice.")
+
+# --- Declarative Disk Provisioning ---
+
+# Example layout spec (JSON):
+# {
+#     "disks": ["/dev/sdb", "/dev/sdc"],
+#     "table": "gpt",
+#     "max_parallel": 8,
+#     "partitions": [
+#         {"size": "512M", "type": "uefi", "filesystem": "fat32", "label": "EFI"},
+#         {"size": "rest", "filesystem": "ext4", "label": "data",
+#          "mkfs_options": ["-E", "lazy_itable_init=1,nodiscard"]}
+#     ]
+# }
+# Sizes need a unit: sfdisk would read a bare number as 512-byte sectors
+PARTITION_SIZE_PATTERN = re.compile(r'^\d+[KMGT]$')
+MAX_DOS_PARTITIONS = 4 # Primary partitions only; logical partitions are not modelled
+# sfdisk type aliases (linux, uefi, ...), MBR hex codes and GPT type GUIDs
+PARTITION_TYPE_PATTERN = re.compile(r'^[A-Za-z0-9_-]+$')
+
+def load_layout_spec(spec_path):
+    """
+    Loads and validates a layout spec file.
+    Returns (spec, errors); spec is None if the file could not be parsed.
+    """
+    try:
+        with open(spec_path) as spec_file:
+            spec = json.load(spec_file)
+    except (OSError, ValueError) as e:
+        return None, [f"Could not read layout spec '{spec_path}': {e}"]
+
+    if not isinstance(spec, dict):
+        return None, ["The layout spec must be a JSON object."]
+
+    errors = []
+    disks = spec.get('disks')
+    if not isinstance(disks, list) or not disks:
+        errors.append("'disks' must be a non-empty list of device paths.")
+        disks = []
+    resolved_disks = []
+    for disk in disks:
+        if not isinstance(disk, str) or not disk.startswith('/dev/'):
+            errors.append(f"Invalid disk path '{disk}'. It should start with '/dev/'.")
+        elif not os.path.exists(disk):
+            errors.append(f"Disk '{disk}' does not exist.")
+        else:
+            # Resolve /dev/disk/by-id/... style links so partition paths can be derived
+            resolved = os.path.realpath(disk)
+            if not stat.S_ISBLK(os.stat(resolved).st_mode):
+                errors.append(f"'{disk}' is not a block device.")
+            elif os.path.exists(f"/sys/class/block/{os.path.basename(resolved)}/partition"):
+                errors.append(f"'{disk}' is a partition, not a whole disk.")
+            resolved_disks.append(resolved)
+    if len(set(resolved_disks)) != len(resolved_disks):
+        errors.append("'disks' contains duplicate entries.")
+    spec['disks'] = resolved_disks
+
+    if spec.get('table', 'gpt') not in ('gpt', 'dos'):
+        errors.append("'table' must be 'gpt' or 'dos'.")
+
+    max_parallel = spec.get('max_parallel')
+    if max_parallel is not None and (not isinstance(max_parallel, int) or isinstance(max_parallel, bool) or max_parallel < 1):
+        errors.append("'max_parallel' must be a positive integer.")
+
+    partitions = spec.get('partitions')
+    if not isinstance(partitions, list) or not partitions:
+        errors.append("'partitions' must be a non-empty list.")
+        partitions = []
+    elif spec.get('table', 'gpt') == 'dos' and len(partitions) > MAX_DOS_PARTITIONS:
+        errors.append(f"A 'dos' table holds at most {MAX_DOS_PARTITIONS} partitions; use 'gpt' for more.")
+    for number, partition in enumerate(partitions, start=1):
+        if not isinstance(partition, dict):
+            errors.append(f"Partition {number}: must be an object.")
+            continue
+        size = str(partition.get('size', 'rest'))
+        if size == 'rest':
+            if number != len(partitions):
+                errors.append(f"Partition {number}: only the last partition can use size 'rest'.")
+        elif not PARTITION_SIZE_PATTERN.match(size):
+            errors.append(f"Partition {number}: invalid size '{size}' (a number with a K, M, G or T unit, e.g. 512M, or 'rest').")
+        partition_type = partition.get('type', 'linux')
+        if not isinstance(partition_type, str) or not PARTITION_TYPE_PATTERN.match(partition_type):
+            errors.append(f"Partition {number}: invalid type '{partition_type}' (e.g. linux, uefi, swap or a type GUID).")
+        label = partition.get('label')
+        if label is not None and (not isinstance(label, str) or not label.isprintable() or '"' in label or '\\' in label):
+            errors.append(f"Partition {number}: 'label' must be a string without quotes, backslashes or control characters.")
+        filesystem = partition.get('filesystem')
+        if filesystem is not None and (not isinstance(filesystem, str) or filesystem not in MKFS_COMMANDS):
+            errors.append(f"Partition {number}: unsupported filesystem '{filesystem}' "
+                          f"(choose from {', '.join(MKFS_COMMANDS)}).")
+        mkfs_options = partition.get('mkfs_options', [])
+        if not isinstance(mkfs_options, list) or not all(isinstance(o, str) for o in mkfs_options):
+            errors.append(f"Partition {number}: 'mkfs_options' must be a list of strings.")
+    return spec, errors
+
+def build_sfdisk_script(spec):
+    """Returns the sfdisk input script for the spec's partition table."""
+    table = spec.get('table', 'gpt')
+    lines = [f"label: {table}"]
+    for partition in spec['partitions']:
+        fields = []
+        size = str(partition.get('size', 'rest'))
+        if size != 'rest':
+            fields.append(f"size={size}")
+        fields.append(f"type={partition.get('type', 'linux')}")
+        if table == 'gpt' and partition.get('label'):
+            fields.append(f"name=\"{partition['label']}\"")
+        lines.append(', '.join(fields))
+    return '\n'.join(lines) + '\n'
+
+def partition_path(disk, number):
+    """Returns the partition device path, e.g. /dev/sdb1 or /dev/nvme0n1p1."""
+    return f"{disk}{'p' if disk[-1].isdigit() else ''}{number}"
+
+def build_mkfs_command(partition, device):
+    """Returns the mkfs command list for a spec partition, or None if it has no filesystem."""
+    filesystem = partition.get('filesystem')
+    if filesystem is None:
+        return None
+    command = MKFS_COMMANDS[filesystem].split() + partition.get('mkfs_options', [])
+    if partition.get('label'):
+        command += [MKFS_LABEL_OPTIONS[filesystem], partition['label']]
+    return command + [device]
+
+def unmount_disk_partitions(disk):
+    """Unmounts every mounted filesystem that lives on `disk` or its partitions."""
+    disk_name = os.path.basename(os.path.realpath(disk))
+    sys_path = f"/sys/block/{disk_name}"
+    # The disk itself plus its partitions, e.g. sda, sda1, sda2 (but not sdaa1)
+    names = {disk_name}
+    try:
+        names.update(entry for entry in os.listdir(sys_path)
+                     if os.path.exists(os.path.join(sys_path, entry, 'partition')))
+    except OSError:
+        pass
+    try:
+        with open('/proc/mounts') as mounts:
+            mounted = [line.split()[0] for line in mounts
+                       if line.startswith('/dev/') and os.path.basename(os.path.realpath(line.split()[0])) in names]
+    except OSError:
+        mounted = []
+    for device in mounted:
+        run_command(['umount', device], sudo_required=True, check=False)
+
+def partition_disk_from_spec(disk, sfdisk_script):
+    """
+    Writes the partition table to `disk` and makes the kernel re-read it.
+    Returns {partition path: (start, size)} in sectors as written, or None on failure.
+    """
+    unmount_disk_partitions(disk)
+    result = run_command(['sfdisk', '--wipe', 'always', '--wipe-partitions', 'always', disk],
+                         sudo_required=True, input_text=sfdisk_script)
+    if not (result and result.returncode == 0):
+        return None
+    run_command(['blockdev', '--rereadpt', disk], sudo_required=True, check=False)
+    result = run_command(['sfdisk', '--json', disk], sudo_required=True)
+    if not result:
+        return None
+    return parse_sfdisk_layout(result.stdout)
+
+def parse_sfdisk_layout(sfdisk_json):
+    """Returns {partition path: (start, size)} from 'sfdisk --json' output."""
+    partitions = json.loads(sfdisk_json).get('partitiontable', {}).get('partitions', [])
+    return {partition['node']: (partition['start'], partition['size']) for partition in partitions}
+
+def partition_matches_layout(device, start, size):
+    """True if the kernel's view of `device` (sysfs start/size) matches the new table."""
+    sys_path = f"/sys/class/block/{os.path.basename(device)}"
+    try:
+        with open(f"{sys_path}/start") as start_file, open(f"{sys_path}/size") as size_file:
+            return int(start_file.read()) == start and int(size_file.read()) == size
+    except (OSError, ValueError):
+        return False
+
+def wait_for_partitions(layout, timeout=30):
+    """
+    Waits until udev has created each partition node in `layout` and the kernel
+    reports the new start/size, so a node left over from the old table is not
+    mistaken for the new partition. Returns the partitions that never matched.
+    """
+    run_command(['udevadm', 'settle'], sudo_required=True, check=False)
+    deadline = time.monotonic() + timeout
+
+    def pending():
+        return [device for device, (start, size) in layout.items()
+                if not (os.path.exists(device) and partition_matches_layout(device, start, size))]
+
+    missing = pending()
+    while missing and time.monotonic() < deadline:
+        time.sleep(0.5)
+        missing = pending()
+    return missing
+
+def run_parallel(jobs, max_parallel):
+    """
+    Runs `jobs` ({name: (function, args)}) concurrently.
+    Returns {name: result}.
+    """
+    with ThreadPoolExecutor(max_workers=max_parallel) as executor:
+        futures = {name: executor.submit(function, *args) for name, (function, args) in jobs.items()}
+        return {name: future.result() for name, future in futures.items()}
+
+def format_device_for_spec(command):
+    """Runs one mkfs command and reports how long it took. Returns True on success."""
+    device = command[-1]
+    start_time = time.time()
+    result = run_command(command, sudo_required=True, capture_output=True, check=True)
+    succeeded = bool(result and result.returncode == 0)
+    print(f"  {device}: {'formatted' if succeeded else 'FAILED'} in {time.time() - start_time:.1f} seconds.")
+    return succeeded
+
+def provision_disks_from_spec():
+    """
+    Partitions and formats many disks at once from a JSON layout spec.
+    All disks are partitioned, then every partition is formatted concurrently.
+    """
+    print("\n--- Provision Disks from Layout Spec ---")
+    spec_path = input("Enter the path to the JSON layout spec file or type 'back' to return: ").strip()
+    if spec_path.lower() == 'back':
+        print("Returning to main menu.")
+        return
+
+    spec, errors = load_layout_spec(spec_path)
+    if errors:
+        print("The layout spec is invalid:")
+        for error in errors:
+            print(f"  - {error}")
+        return False
+
+    disks = spec['disks']
+    partitions = spec['partitions']
+    max_parallel = spec.get('max_parallel') or len(disks) * len(partitions)
+    sfdisk_script = build_sfdisk_script(spec)
+
+    print(f"\nPartition table ({spec.get('table', 'gpt')}) to be written to {len(disks)} disk(s):")
+    for number, partition in enumerate(partitions, start=1):
+        mkfs_command = build_mkfs_command(partition, partition_path('<disk>', number))
+        print(f"  {number}. size={partition.get('size', 'rest')}, type={partition.get('type', 'linux')}, "
+              f"format: {' '.join(mkfs_command) if mkfs_command else 'none'}")
+    print("Target disks:")
+    for disk in disks:
+        print(f"  {disk}")
+
+    if not confirm_action(f"REPARTITION AND FORMAT {len(disks)} disk(s): {', '.join(disks)}. ALL DATA ON THEM WILL BE LOST"):
+        return
+
+    start_time = time.time()
+    print("\nWriting partition tables...")
+    partitioned = run_parallel({disk: (partition_disk_from_spec, (disk, sfdisk_script)) for disk in disks}, max_parallel)
+    for disk, layout in partitioned.items():
+        if layout is None:
+            print(f"  {disk}: partitioning FAILED, it will not be formatted.")
+    ready_disks = [disk for disk in disks if partitioned[disk] is not None]
+
+    mkfs_commands = []
+    for disk in ready_disks:
+        for number, partition in enumerate(partitions, start=1):
+            mkfs_command = build_mkfs_command(partition, partition_path(disk, number))
+            if mkfs_command:
+                mkfs_commands.append(mkfs_command)
+
+    # Partitions the written table doesn't contain can never appear, the rest are waited for
+    written_layout = {}
+    for disk in ready_disks:
+        written_layout.update(partitioned[disk])
+    targets = [command[-1] for command in mkfs_commands]
+    missing = [device for device in targets if device not in written_layout]
+    missing += wait_for_partitions({device: written_layout[device] for device in targets if device in written_layout})
+    if missing:
+        print(f"Partition devices did not appear in time: {', '.join(missing)}")
+        mkfs_commands = [command for command in mkfs_commands if command[-1] not in missing]
+
+    print(f"\nFormatting {len(mkfs_commands)} partition(s), up to {max_parallel} at a time...")
+    formatted = run_parallel({command[-1]: (format_device_for_spec, (command,)) for command in mkfs_commands}, max_parallel)
+    failures = [device for device, succeeded in formatted.items() if not succeeded] + missing
+    failures += [disk for disk in disks if partitioned[disk] is None]
+
+    print(f"\nProvisioning finished in {time.time() - start_time:.1f} seconds.")
+    if failures:
+        print(f"Failed: {', '.join(failures)}")
+        return False
+    else:
+        print(f"All {len(disks)} disk(s) partitioned and formatted successfully.")
+        return True
 
 def show_developer_info():
     """Displays information about the developer."""
@@ -658,6 +1590,7 @@ def show_developer_info():
     print("Purpose: A command-line utility for managing storage devices on Linux systems.")
     print("Disclaimer: Use with caution. Incorrect operations can lead to data loss.")
     print("-----------------------------\n")
+    return True
 
 # --- Main Menu ---
 
@@ -682,58 +1615,147 @@ def main_menu():
         print("13. Format Partition Only (mkfs)")
         print("14. View S.M.A.R.T. Errors Only")
         print("15. Benchmark Disk Read/Write Speed (dd)")
+        print("16. I/O Throttling Settings (bandwidth/IOPS/priority)")
+        print("17. Provision Disks from Layout Spec (sfdisk/mkfs, parallel)")
         print("-------------------------------------------------")
         print("00. Developer Info") # New option
         print("0. Exit")
         print("-------------------------------------------------")
 
-        choice = input("Enter your choice (0-15, 00 for info): ").strip()
+        choice = input("Enter your choice (0-17, 00 for info): ").strip()
 
-        if choice == '1':
-            list_storage_devices()
-        elif choice == '2':
-            copy_data()
-        elif choice == '3':
-            delete_data()
-        elif choice == '4':
-            format_disk()
-        elif choice == '5':
-            manage_partitions()
-        elif choice == '6':
-            check_disk_health()
-        elif choice == '7':
-            view_disk_usage()
-        elif choice == '8':
-            create_directory()
-        elif choice == '9':
-            mount_unmount_device()
-        elif choice == '10':
-            backup_disk_to_image()
-        elif choice == '11':
-            restore_image_to_disk()
-        elif choice == '12':
-            create_bootable_usb()
-        elif choice == '13':
-            format_partition()
-        elif choice == '14':
-            view_smart_errors()
-        elif choice == '15':
-            benchmark_disk_speed()
-        elif choice == '00': # Handle the new '00' choice
-            show_developer_info()
-        elif choice == '0':
+        if choice == '0':
             print("Exiting tool. Goodbye!")
             sys.exit(0)
+        elif choice in MENU_ACTIONS:
+            run_menu_action(choice)
         else:
             print("Name:Sowmitro Halder Badhon ")
             print("https://wa.me/+8801921964044")
             print("Denote $10 Buy a coffee  Bkash/Nagod  01921964044 ")
 
+# --- Persistent Shell Session ---
+
+SHELL_HELP = """
+Commands:
+  <number>        Run a main menu action (e.g. 10 for backup, 'menu' lists them)
+  <name>          Run an action by name (e.g. backup, restore, smart, provision)
+  menu            Show the numbered actions
+  refresh         Forget cached device topology and S.M.A.R.T. results
+  history         Show the actions run in this session
+  throttle        Show the current I/O throttling settings
+  help            Show this help
+  exit / quit     Leave the shell
+"""
+
+def run_menu_action(choice):
+    """Runs the action for a menu `choice` and records it in the session history."""
+    name, action = MENU_ACTIONS[choice]
+    started = time.time()
+    try:
+        # Actions return True on success, False on failure and None if cancelled
+        outcome = action()
+        status = {True: 'ok', False: 'failed'}.get(outcome, 'cancelled')
+    except KeyboardInterrupt:
+        status = 'interrupted'
+        print("\nAction interrupted.")
+    except SystemExit:
+        # run_command exits when root is required; keep the session alive instead
+        status = 'failed'
+    SESSION['history'].append({'action': name, 'started': started,
+                               'duration': time.time() - started, 'status': status})
+
+def show_session_history():
+    """Prints the actions run in this session."""
+    if not SESSION['history']:
+        print("No actions run in this session yet.")
+        return
+    for entry in SESSION['history']:
+        started = time.strftime('%H:%M:%S', time.localtime(entry['started']))
+        print(f"{started}  {entry['action']:<40} {entry['duration']:8.1f}s  {entry['status']}")
+
+def interactive_shell():
+    """
+    Long-lived command shell. Device topology, S.M.A.R.T. results, throttling
+    settings and the action history stay in memory between commands.
+    """
+    try:
+        import readline # noqa: F401 - Line editing and history for input(), when available
+    except ImportError:
+        pass
+
+    print("Storage Device Management Tool - shell mode. Type 'help' for commands.")
+    while True:
+        try:
+            line = input("disk-tool> ").strip().lower()
+        except (EOFError, KeyboardInterrupt):
+            print()
+            break
+
+        if not line:
+            continue
+        elif line in ('exit', 'quit', '0'):
+            break
+        elif line == 'help':
+            print(SHELL_HELP)
+        elif line == 'menu':
+            for number, (name, _) in MENU_ACTIONS.items():
+                print(f"{number:>3}. {name}")
+        elif line == 'refresh':
+            SESSION['devices'] = None
+            SESSION['smart'].clear()
+            print("Cached device topology and S.M.A.R.T. results cleared.")
+        elif line == 'history':
+            show_session_history()
+        elif line == 'throttle':
+            print(describe_throttle())
+        elif line in MENU_ACTIONS:
+            run_menu_action(line)
+        elif line in SHELL_COMMAND_NAMES:
+            run_menu_action(SHELL_COMMAND_NAMES[line])
+        else:
+            print(f"Unknown command '{line}'. Type 'help' for commands.")
+    print("Exiting tool. Goodbye!")
+
+# Main menu choices: number -> (description, function)
+MENU_ACTIONS = {
+    '1': ('List Storage Devices', list_storage_devices),
+    '2': ('Copy Data', copy_data),
+    '3': ('Delete Data', delete_data),
+    '4': ('Format Entire Disk', format_disk),
+    '5': ('Manage Partitions', manage_partitions),
+    '6': ('Check Disk Health', check_disk_health),
+    '7': ('View Disk Usage', view_disk_usage),
+    '8': ('Create Directory', create_directory),
+    '9': ('Mount/Unmount Device', mount_unmount_device),
+    '10': ('Backup Partition/Disk to Image', backup_disk_to_image),
+    '11': ('Restore Image to Partition/Disk', restore_image_to_disk),
+    '12': ('Create Bootable USB from ISO', create_bootable_usb),
+    '13': ('Format Partition Only', format_partition),
+    '14': ('View S.M.A.R.T. Errors Only', view_smart_errors),
+    '15': ('Benchmark Disk Read/Write Speed', benchmark_disk_speed),
+    '16': ('I/O Throttling Settings', configure_io_throttling),
+    '17': ('Provision Disks from Layout Spec', provision_disks_from_spec),
+    '00': ('Developer Info', show_developer_info),
+}
+
+# Shell command names -> main menu choices
+SHELL_COMMAND_NAMES = {
+    'list': '1', 'ls': '1', 'copy': '2', 'delete': '3', 'format': '4',
+    'partition': '5', 'health': '6', 'usage': '7', 'mkdir': '8', 'mount': '9',
+    'backup': '10', 'restore': '11', 'usb': '12', 'format-partition': '13',
+    'smart': '14', 'benchmark': '15', 'throttle-settings': '16', 'provision': '17',
+    'info': '00',
+}
+
 if __name__ == "__main__":
-    if os.geteuid() != 0:
+    if not is_root():
         print("Warning: Most operations require root privileges.")
         print("It is highly recommended to run this script with 'sudo':")
         print("  sudo python3 disk_tool.py")
         print("Continuing without sudo might limit functionality.")
         input("Press Enter to continue or Ctrl+C to exit and restart with sudo...")
-    main_menu()
+    if '--shell' in sys.argv[1:]:
+        interactive_shell()
+    else:
+        main_menu()
@@ -0,0 +1,53 @@
+import benchmark_suite
+
+
+def metrics(throughput=100.0, cpu=1.0, rss=4096):
+    return {'throughput_mbps': throughput, 'cpu_seconds': cpu, 'peak_rss_kb': rss}
+
+
+def test_no_regression_within_threshold():
+    baseline = {'backup/zero': metrics()}
+    results = {'backup/zero': metrics(throughput=90.0, cpu=1.1, rss=4500)}
+    assert benchmark_suite.find_regressions(results, baseline, 0.15, 256) == []
+
+
+def test_relative_and_absolute_regressions_are_reported():
+    baseline = {'backup/zero': metrics()}
+    results = {'backup/zero': metrics(throughput=50.0, cpu=2.0, rss=16384)}
+    found = {metric for _, metric, _, _ in benchmark_suite.find_regressions(results, baseline, 0.15, 256)}
+    assert found == {'throughput_mbps', 'cpu_seconds', 'peak_rss_kb'}
+
+
+def test_small_absolute_changes_are_noise():
+    # 3x the CPU time and half the throughput, but only milliseconds of difference
+    baseline = {'usb/random': metrics(throughput=8000.0, cpu=0.01, rss=1024)}
+    results = {'usb/random': metrics(throughput=4000.0, cpu=0.03, rss=2048)}
+    assert benchmark_suite.find_regressions(results, baseline, 0.15, 64) == []
+
+
+def test_throughput_floor_is_in_seconds():
+    baseline = {'restore/mixed': metrics(throughput=1000.0)}
+    results = {'restore/mixed': metrics(throughput=500.0)}
+    # 64 MB: 0.064 s -> 0.128 s is noise, 1024 MB: 1.0 s -> 2.0 s is not
+    assert benchmark_suite.find_regressions(results, baseline, 0.15, 64) == []
+    assert benchmark_suite.find_regressions(results, baseline, 0.15, 1024) == [
+        ('restore/mixed', 'throughput_mbps', 1000.0, 500.0)]
+
+
+def test_failed_runs_are_failures_even_without_baseline():
+    results = {'backup/zero': None, 'usb/zero': metrics()}
+    baseline = {'backup/zero': None}
+    assert benchmark_suite.find_failures(results, baseline, {'backup/zero', 'usb/zero'}) == ['backup/zero']
+    assert benchmark_suite.find_failures(results, {}, {'backup/zero', 'usb/zero'}) == ['backup/zero']
+
+
+def test_missing_results_are_failures_only_for_selected_paths():
+    baseline = {'backup/zero': metrics(), 'usb/random': metrics()}
+    results = {}
+    assert benchmark_suite.find_failures(results, baseline, {'backup/zero'}) == ['backup/zero']
+
+
+def test_wipe_runs_once_per_target():
+    names = benchmark_suite.result_names(['backup', 'wipe'], ['zero', 'random'])
+    assert names == ['backup/zero', 'backup/random', 'wipe/target']
+    assert benchmark_suite.result_names(['wipe'], ['zero', 'random']) == ['wipe/target']
@@ -0,0 +1,104 @@
+import json
+
+import disk_tool
+
+
+def load_spec(tmp_path, spec):
+    spec_file = tmp_path / 'layout.json'
+    spec_file.write_text(json.dumps(spec))
+    return disk_tool.load_layout_spec(str(spec_file))
+
+
+def partition_errors(tmp_path, partitions, table='gpt'):
+    # Disk errors are irrelevant here; only keep the partition related ones
+    _, errors = load_spec(tmp_path, {'disks': ['/dev/null'], 'table': table, 'partitions': partitions})
+    return [error for error in errors if 'dev/null' not in error]
+
+
+def test_spec_must_be_an_object(tmp_path):
+    spec, errors = load_spec(tmp_path, [1, 2])
+    assert spec is None
+    assert errors == ["The layout spec must be a JSON object."]
+
+
+def test_non_string_disks_are_rejected(tmp_path):
+    _, errors = load_spec(tmp_path, {'disks': [{}, ['x']], 'partitions': [{}]})
+    assert len([error for error in errors if 'Invalid disk path' in error]) == 2
+
+
+def test_character_device_is_not_a_disk(tmp_path):
+    _, errors = load_spec(tmp_path, {'disks': ['/dev/null'], 'partitions': [{}]})
+    assert "'/dev/null' is not a block device." in errors
+
+
+def test_size_needs_a_unit(tmp_path):
+    errors = partition_errors(tmp_path, [{'size': 100}, {'size': '512M'}, {'size': 'rest'}])
+    assert len(errors) == 1
+    assert errors[0].startswith("Partition 1: invalid size '100'")
+
+
+def test_only_last_partition_can_use_rest(tmp_path):
+    errors = partition_errors(tmp_path, [{'size': 'rest'}, {'size': '1G'}])
+    assert errors == ["Partition 1: only the last partition can use size 'rest'."]
+
+
+def test_dos_table_holds_at_most_four_partitions(tmp_path):
+    assert partition_errors(tmp_path, [{'size': '1G'}] * 4 + [{}], table='dos')
+    assert not partition_errors(tmp_path, [{'size': '1G'}] * 3 + [{}], table='dos')
+    assert not partition_errors(tmp_path, [{'size': '1G'}] * 4 + [{}], table='gpt')
+
+
+def test_labels_that_could_inject_sfdisk_lines_are_rejected(tmp_path):
+    for label in ['a\nsize=1G', 'a"b', 'a\\b', 5]:
+        errors = partition_errors(tmp_path, [{'label': label}])
+        assert any("'label' must be a string" in error for error in errors), label
+
+
+def test_invalid_types_and_filesystems_are_rejected(tmp_path):
+    errors = partition_errors(tmp_path, [{'type': 'linux\nx'}, {'filesystem': ['ext4']}])
+    assert any("Partition 1: invalid type" in error for error in errors)
+    assert any("Partition 2: unsupported filesystem" in error for error in errors)
+
+
+def test_build_sfdisk_script():
+    spec = {'table': 'gpt', 'partitions': [
+        {'size': '512M', 'type': 'uefi', 'label': 'EFI System'},
+        {'filesystem': 'ext4'},
+    ]}
+    assert disk_tool.build_sfdisk_script(spec) == (
+        'label: gpt\n'
+        'size=512M, type=uefi, name="EFI System"\n'
+        'type=linux\n'
+    )
+
+
+def test_build_sfdisk_script_dos_has_no_names():
+    spec = {'table': 'dos', 'partitions': [{'size': '1G', 'label': 'boot'}]}
+    assert disk_tool.build_sfdisk_script(spec) == 'label: dos\nsize=1G, type=linux\n'
+
+
+def test_partition_path_naming():
+    assert disk_tool.partition_path('/dev/sdb', 1) == '/dev/sdb1'
+    assert disk_tool.partition_path('/dev/nvme0n1', 2) == '/dev/nvme0n1p2'
+    assert disk_tool.partition_path('/dev/loop0', 3) == '/dev/loop0p3'
+    assert disk_tool.partition_path('/dev/mmcblk0', 1) == '/dev/mmcblk0p1'
+
+
+def test_build_mkfs_command():
+    partition = {'filesystem': 'ext4', 'label': 'data', 'mkfs_options': ['-E', 'lazy_itable_init=1,nodiscard']}
+    assert disk_tool.build_mkfs_command(partition, '/dev/sdb2') == [
+        'mkfs.ext4', '-F', '-E', 'lazy_itable_init=1,nodiscard', '-L', 'data', '/dev/sdb2']
+    assert disk_tool.build_mkfs_command({'filesystem': 'fat32', 'label': 'EFI'}, '/dev/sdb1') == [
+        'mkfs.fat', '-F', '32', '-n', 'EFI', '/dev/sdb1']
+    assert disk_tool.build_mkfs_command({}, '/dev/sdb3') is None
+
+
+def test_parse_sfdisk_layout():
+    output = json.dumps({'partitiontable': {'label': 'gpt', 'partitions': [
+        {'node': '/dev/sdb1', 'start': 2048, 'size': 1048576, 'type': 'C12A7328-F81F-11D2-BA4B-00A0C93EC93B'},
+        {'node': '/dev/sdb2', 'start': 1050624, 'size': 2000000},
+    ]}})
+    assert disk_tool.parse_sfdisk_layout(output) == {
+        '/dev/sdb1': (2048, 1048576),
+        '/dev/sdb2': (1050624, 2000000),
+    }
@@ -0,0 +1,55 @@
+import time
+
+import pytest
+
+import disk_tool
+
+
+def test_parse_throttle_limit_accepts_positive_and_unlimited_values():
+    assert disk_tool.parse_throttle_limit('50') == 50.0
+    assert disk_tool.parse_throttle_limit('0.5') == 0.5
+    assert disk_tool.parse_throttle_limit('0') is None
+    assert disk_tool.parse_throttle_limit('none') is None
+    assert disk_tool.parse_throttle_limit('') is None
+
+
+@pytest.mark.parametrize('value', ['-5', 'nan', 'inf', '-inf', 'fast'])
+def test_parse_throttle_limit_rejects_invalid_values(value):
+    with pytest.raises(ValueError):
+        disk_tool.parse_throttle_limit(value)
+
+
+def test_token_bucket_unlimited_does_not_wait():
+    bucket = disk_tool.TokenBucket(lambda: None)
+    start = time.monotonic()
+    bucket.consume(10 ** 9)
+    assert time.monotonic() - start < 0.1
+
+
+def test_token_bucket_waits_for_debt():
+    bucket = disk_tool.TokenBucket(lambda: 100)
+    start = time.monotonic()
+    bucket.consume(30) # 0.3 s of debt at 100 tokens per second
+    assert 0.25 <= time.monotonic() - start < 1.0
+
+
+def test_token_bucket_picks_up_rate_change_while_sleeping():
+    limits = {'rate': 0.1}
+    polls = []
+
+    def poll():
+        polls.append(time.monotonic())
+        limits['rate'] = 1000
+
+    bucket = disk_tool.TokenBucket(lambda: limits['rate'], poll=poll)
+    start = time.monotonic()
+    bucket.consume(8) # 80 s of debt at the starting rate
+    assert time.monotonic() - start < disk_tool.TokenBucket.MAX_SLEEP + 0.5
+    assert polls
+
+
+def test_write_io_max_rounds_caps_up(tmp_path, monkeypatch):
+    monkeypatch.setitem(disk_tool.THROTTLE_SETTINGS, 'mbps', 0.0000001)
+    monkeypatch.setitem(disk_tool.THROTTLE_SETTINGS, 'iops', 0.5)
+    disk_tool.write_io_max(str(tmp_path), ['8:0'])
+    assert (tmp_path / 'io.max').read_text() == "8:0 rbps=1 wbps=1 riops=1 wiops=1\n"